@@ -1,27 +1,31 @@
 import os
-import threading
-import time
 import json
-import re
 import time
-import threading
-import os
-from urllib.parse import urljoin
-from playwright.sync_api import sync_playwright, Error as PlaywrightError
-from flask import Flask, request, render_template, send_from_directory, flash, redirect, url_for
-from m3u8_downloader_lib import download_m3u8_video, DownloaderError
+from flask import Flask, request, render_template, send_from_directory, flash, redirect, url_for, jsonify, Response
+from werkzeug.utils import safe_join
+from job_queue import JobQueue, DEFAULT_DB_PATH, QUEUED, RUNNING
+from m3u8_downloader_lib import partial_output_path
+from page_scraper import validate_batch_item
 
 # --- Configuration ---
 DOWNLOAD_FOLDER = 'downloads'
 ALLOWED_EXTENSIONS = {'mp4'} # Currently only used for serving, not upload
+FOLLOW_CHUNK_SIZE = 64 * 1024
+FOLLOW_POLL_INTERVAL = 0.5 # Seconds between checks for new data while following a partial file
+FOLLOW_IDLE_TIMEOUT = 120 # Give up following if the partial file stops growing (worker died?)
 
 app = Flask(__name__)
 app.secret_key = 'super secret key' # Change this in a real app!
 app.config['DOWNLOAD_FOLDER'] = os.path.abspath(DOWNLOAD_FOLDER)
+app.config['QUEUE_DB'] = DEFAULT_DB_PATH
 
 # Ensure download folder exists
 os.makedirs(app.config['DOWNLOAD_FOLDER'], exist_ok=True)
 
+# Downloads are executed by separate worker processes (see worker.py) that
+# claim jobs from this queue; the web tier only validates and enqueues.
+job_queue = JobQueue(app.config['QUEUE_DB'])
+
 # --- Routes ---
 
 @app.route('/', methods=['GET'])
@@ -29,125 +33,9 @@ def index():
     """Renders the main page with the input form."""
     return render_template('index.html')
 
-def run_download_thread(m3u8_url, output_path):
-    """Wrapper function to run download in a thread and log errors."""
-    try:
-        print(f"[Thread Start] Downloading {m3u8_url} to {output_path}")
-        success = download_m3u8_video(m3u8_url, output_path)
-        if success:
-            print(f"[Thread Success] Finished downloading {m3u8_url}")
-        else:
-            print(f"[Thread Failure] Download reported failure for {m3u8_url}")
-    except Exception as e:
-        # Log exceptions occurring within the thread
-        print(f"[Thread Error] Failed to download {m3u8_url}: {e}")
-        # Optionally log traceback here too
-        # import traceback
-        # traceback.print_exc()
-
-# --- Playwright Scraping Function ---
-# NOTE: This runs synchronously and launches a browser per request, which is inefficient
-# for high load. Consider async/global context management for production.
-def scrape_page_for_m3u8(page_url):
-    """Uses Playwright to load a page, find title and first M3U8 network request."""
-    m3u8_url_found = None
-    page_title = None
-    print(f"  [Playwright] Launching browser for {page_url}")
-
-    # Using a context manager ensures the browser is closed properly
-    with sync_playwright() as p:
-        try:
-            # Launch headless browser (Chromium is often a good default)
-            # Use a realistic user agent
-            user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(user_agent=user_agent)
-            page = context.new_page()
-
-            # --- Network Interception ---
-            # Use a list to store the found URL (accessible from inner scope)
-            found_urls = []
-            def handle_request(route, request):
-                 if ".m3u8" in request.url and not found_urls: # Find first m3u8 request
-                     print(f"  [Playwright] Intercepted M3U8 request: {request.url}")
-                     found_urls.append(request.url)
-                 route.continue_() # Let the request proceed
-
-            # Start routing *before* navigation
-            page.route("**/*", handle_request)
-
-            # --- Navigation and Waiting ---
-            print(f"  [Playwright] Navigating to {page_url}")
-            # Increased timeout for potentially slow pages
-            page.goto(page_url, timeout=60000, wait_until='networkidle')
-            # Alternative wait: page.wait_for_timeout(5000) # Wait fixed time after load
-
-            print(f"  [Playwright] Page loaded. Checking for title and intercepted URL.")
-            page_title = page.title()
-
-            # Check if the handler found an M3U8 URL
-            if found_urls:
-                m3u8_url_found = found_urls[0]
-
-            # Fallback: If network interception didn't find it, try simple HTML check again
-            # (Sometimes it might be in the initial source after all)
-            if not m3u8_url_found:
-                 print("  [Playwright] M3U8 not found in network requests, checking HTML source as fallback...")
-                 # Import here as it's only needed for the fallback
-                 from bs4 import BeautifulSoup
-                 content = page.content()
-                 soup = BeautifulSoup(content, 'html.parser')
-                 for tag in soup.find_all(['video', 'source']):
-                     src = tag.get('src')
-                     if src and '.m3u8' in src:
-                         m3u8_url_found = urljoin(page_url, src)
-                         print(f"  [Playwright] Found M3U8 in HTML <{tag.name} src>: {m3u8_url_found}")
-                         break
-                 if not m3u8_url_found:
-                     for tag in soup.find_all('a'):
-                         href = tag.get('href')
-                         if href and '.m3u8' in href:
-                             m3u8_url_found = urljoin(page_url, href)
-                             print(f"  [Playwright] Found M3U8 in HTML <a href>: {m3u8_url_found}")
-                             break
-
-            browser.close()
-            print(f"  [Playwright] Browser closed for {page_url}")
-
-        except PlaywrightError as e:
-            print(f"  [Playwright Error] Error during scraping {page_url}: {e}")
-            # Ensure browser is closed if it exists and wasn't closed yet
-            if 'browser' in locals() and browser.is_connected():
-                 browser.close()
-            return None, None # Return None on Playwright errors
-        except Exception as e:
-             print(f"  [Playwright Error] Unexpected error during scraping {page_url}: {e}")
-             if 'browser' in locals() and browser.is_connected():
-                 browser.close()
-             return None, None # Return None on other errors
-
-    return page_title, m3u8_url_found
-
-
-# --- Filename Sanitization ---
-def _sanitize_filename(name):
-    """Removes invalid characters for filenames and limits length."""
-    # Remove invalid characters (Windows example, adjust for cross-platform if needed)
-    name = re.sub(r'[\\/*?:"<>|]', "", name)
-    # Replace sequences of whitespace with a single underscore
-    name = re.sub(r'\s+', '_', name)
-    # Limit length (optional)
-    max_len = 150
-    if len(name) > max_len:
-        name = name[:max_len]
-    # Ensure it's not empty or just dots after sanitization
-    if not name or set(name) == {'.'}:
-        return None
-    return name
-
 @app.route('/download', methods=['POST'])
 def handle_download():
-    """Handles the batch download request by scraping pages."""
+    """Validates the batch request and enqueues one job per item for the workers."""
     batch_data_json = request.form.get('batch_data')
     if not batch_data_json:
         flash('No batch data received.', 'error')
@@ -165,100 +53,30 @@ def handle_download():
 
     started_count = 0
     skipped_count = 0
-
-    # Remove requests session setup, Playwright handles its own context
-    # session = requests.Session() ...
+    # Let workers write a playable prefix so files can be watched while downloading
+    progressive = request.form.get('progressive') == 'on'
+    # Also mux the playlist's default WebVTT subtitle rendition into each MP4
+    subtitles = request.form.get('subtitles') == 'on'
 
     for item_index, item in enumerate(batch_items): # Use enumerate for unique fallback filenames
-        if not isinstance(item, dict) or 'type' not in item:
-            print(f"Skipping invalid batch item format (missing type): {item}")
+        page_url_for_log = item.get('page_url', item.get('m3u8_url', 'N/A')) if isinstance(item, dict) else 'N/A' # For logging
+        try:
+            job_payload = validate_batch_item(item, item_index)
+        except ValueError as e:
+            print(f"Skipping {e}")
             skipped_count += 1
             continue
 
-        item_type = item.get('type')
-        m3u8_url_to_download = None
-        output_filename = None
-        page_url_for_log = item.get('page_url', item.get('m3u8_url', 'N/A')) # For logging
-
         try:
-            if item_type == 'scrape':
-                page_url = item.get('page_url', '').strip()
-                if not page_url or not page_url.startswith(('http://', 'https://')):
-                    print(f"Skipping scrape item with invalid page URL: {page_url}")
-                    skipped_count += 1
-                    continue
-                
-                print(f"Processing scrape task for page: {page_url}")
-                page_title, m3u8_url_found = scrape_page_for_m3u8(page_url)
-
-                if not m3u8_url_found:
-                    print(f"  Failed to find M3U8 link for {page_url} after scraping.")
-                    skipped_count += 1
-                    continue
-                
-                m3u8_url_to_download = m3u8_url_found
-
-                # Generate filename from title
-                if page_title:
-                    sanitized_title = _sanitize_filename(page_title)
-                    if sanitized_title:
-                        output_filename = sanitized_title + ".mp4"
-                    else:
-                        print(f"  Page title '{page_title}' resulted in invalid filename after sanitization.")
-                
-                # Fallback filename for scrape if title missing/invalid
-                if not output_filename:
-                    timestamp = time.strftime("%Y%m%d-%H%M%S")
-                    safe_part = m3u8_url_to_download.split('/')[-1].replace('.m3u8', '').replace('.', '_')
-                    output_filename = f"scraped_video_{safe_part}_{timestamp}_{item_index}.mp4"
-                    print(f"  Using fallback filename: {output_filename}")
-
-            elif item_type == 'direct':
-                m3u8_url = item.get('m3u8_url', '').strip()
-                desired_filename_base = item.get('filename', '').strip()
-
-                # Relax validation: check for http/https start and if '.m3u8' appears before any '?'
-                url_path_part = m3u8_url.split('?')[0]
-                if not m3u8_url or not m3u8_url.startswith(('http://', 'https://')) or '.m3u8' not in url_path_part:
-                    print(f"Skipping direct item with invalid M3U8 URL format: {m3u8_url}")
-                    skipped_count += 1
-                    continue
-                
-                if not desired_filename_base:
-                     print(f"Skipping direct item with missing filename for URL: {m3u8_url}")
-                     skipped_count += 1
-                     continue
-
-                m3u8_url_to_download = m3u8_url
-                
-                # Sanitize provided filename
-                sanitized_base = _sanitize_filename(desired_filename_base)
-                if not sanitized_base:
-                     print(f"Skipping direct item with invalid desired filename after sanitization: {desired_filename_base}")
-                     skipped_count += 1
-                     continue
-                output_filename = sanitized_base + ".mp4"
-                print(f"Processing direct task for M3U8: {m3u8_url_to_download} -> {output_filename}")
-
-            else:
-                print(f"Skipping item with unknown type: {item_type}")
-                skipped_count += 1
-                continue
-
-            # --- Start Download Thread (common logic) ---
-            if m3u8_url_to_download and output_filename:
-                output_path = os.path.join(app.config['DOWNLOAD_FOLDER'], output_filename)
-                print(f"  Starting background download for: M3U8='{m3u8_url_to_download}', Output='{output_path}'")
-                thread = threading.Thread(target=run_download_thread, args=(m3u8_url_to_download, output_path), daemon=True)
-                thread.start()
-                started_count += 1
-            else:
-                 # This case should ideally not be reached if validation above is correct
-                 print(f"  Skipping item due to missing M3U8 URL or output filename after processing: {item}")
-                 skipped_count += 1
+            # --- Enqueue Job (common logic) ---
+            job_payload['progressive'] = progressive
+            job_payload['subtitles'] = subtitles
+            job_id = job_queue.enqueue(job_payload)
+            print(f"  Queued job {job_id} for {page_url_for_log}")
+            started_count += 1
 
         except Exception as e:
-            # Catch errors during scraping or filename generation for a specific item
+            # Catch errors during enqueueing for a specific item
             print(f"  Error processing item for {page_url_for_log}: {e}")
             import traceback
             traceback.print_exc()
@@ -267,7 +85,7 @@ def handle_download():
 
     # --- Redirect back with feedback ---
     if started_count > 0:
-        flash(f'Started {started_count} downloads in the background. Check the "{DOWNLOAD_FOLDER}" directory for progress/completion.', 'info')
+        flash(f'Queued {started_count} downloads. Check the "{DOWNLOAD_FOLDER}" directory or /jobs for progress/completion.', 'info')
     if skipped_count > 0:
         flash(f'Skipped {skipped_count} invalid entries.', 'warning')
     if started_count == 0 and skipped_count == 0:
@@ -276,10 +94,80 @@ def handle_download():
     return redirect(url_for('index'))
 
 
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Returns the most recent queued/running/finished jobs as JSON."""
+    return jsonify(job_queue.list_jobs())
+
+
+def _follow_partial_file(partial_path, final_path):
+    """Yields a growing file's bytes, waiting for more until its download finishes."""
+    last_growth = time.time()
+    with open(partial_path, 'rb') as f:
+        while True:
+            chunk = f.read(FOLLOW_CHUNK_SIZE)
+            if chunk:
+                last_growth = time.time()
+                yield chunk
+                continue
+            # Writer removes the partial file once the MP4 is done (or the job failed)
+            if not os.path.exists(partial_path) or os.path.exists(final_path):
+                remaining = f.read()
+                if remaining:
+                    yield remaining
+                return
+            if time.time() - last_growth > FOLLOW_IDLE_TIMEOUT:
+                print(f"Stopped following {partial_path}: no new data for {FOLLOW_IDLE_TIMEOUT}s")
+                return
+            time.sleep(FOLLOW_POLL_INTERVAL)
+
+def _wants_whole_stream():
+    """True if the request has no Range header or asks for everything ("bytes=0-")."""
+    byte_range = request.range
+    if byte_range is None:
+        return True
+    return byte_range.units == 'bytes' and byte_range.ranges == [(0, None)]
+
+def _is_orphaned_partial(filename):
+    """True if the newest job writing filename has finished, so nobody will complete its partial file."""
+    job = job_queue.latest_for_output(filename)
+    return job is not None and job['status'] not in (QUEUED, RUNNING)
+
 @app.route('/downloads/<filename>')
 def serve_file(filename):
-    """Serves the downloaded file."""
+    """
+    Serves the downloaded file.
+
+    While a progressive job is still running, the ordered TS prefix written so far
+    is served instead, with Range support against its current size. Add
+    ?follow=1 to keep the response open and stream new data as it arrives; this
+    applies to requests for the whole file (no Range, or "bytes=0-"), other ranges
+    are answered from the bytes written so far.
+    """
     print(f"Serving file: {filename} from {app.config['DOWNLOAD_FOLDER']}")
+    final_path = safe_join(app.config['DOWNLOAD_FOLDER'], filename)
+    if final_path and not os.path.exists(final_path):
+        partial_path = partial_output_path(final_path)
+        if os.path.exists(partial_path) and _is_orphaned_partial(filename):
+            # Its job ended without producing the MP4 (e.g. aborted, then out of attempts)
+            print(f"Removing orphaned partial file {partial_path}")
+            try:
+                os.remove(partial_path)
+            except FileNotFoundError:
+                pass
+        if os.path.exists(partial_path):
+            if request.args.get('follow') and _wants_whole_stream():
+                # The total length is unknown until the download ends, so a plain 200 with no
+                # Content-Length and no Accept-Ranges; players read it as a live stream.
+                response = Response(_follow_partial_file(partial_path, final_path), mimetype='video/mp2t')
+            else:
+                # conditional=True answers Range requests from the bytes written so far
+                # (206 with the current size, 416 past the end)
+                response = send_from_directory(app.config['DOWNLOAD_FOLDER'], os.path.basename(partial_path),
+                                               mimetype='video/mp2t', conditional=True, etag=False)
+            response.headers['Cache-Control'] = 'no-store' # Length changes as the file grows
+            response.headers['X-Download-Complete'] = 'false'
+            return response
     try:
         return send_from_directory(app.config['DOWNLOAD_FOLDER'], filename, as_attachment=True)
     except FileNotFoundError:
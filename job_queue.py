@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+
+# --- Configuration ---
+DEFAULT_DB_PATH = os.environ.get('M3U8_QUEUE_DB', os.path.abspath('jobs.db'))
+DEFAULT_LEASE_SECONDS = 60 # A worker must heartbeat within this window or its job is re-queued
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker_id TEXT,
+    lease_expires REAL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id);
+"""
+
+def make_worker_id():
+    """Returns an identifier unique to this process on this machine."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class JobQueue:
+    """
+    Durable job queue backed by a SQLite file.
+
+    Jobs are claimed with a time-limited lease. A worker keeps its lease alive
+    with heartbeat(); if it dies, the lease expires and the job is re-queued
+    (or marked failed once max_attempts is reached) on the next claim().
+
+    Every method opens its own short-lived connection, so one JobQueue object
+    is safe to share between threads, and several processes (or machines on a
+    shared filesystem that supports locking) can point at the same file.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # isolation_level=None: we issue BEGIN IMMEDIATE ourselves so that claims
+        # take the write lock before reading, which keeps them atomic across processes.
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _write(self, sql, params):
+        """Runs a single write statement in its own transaction, returns rows affected."""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def enqueue(self, payload, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """Adds a job (a JSON-serialisable dict) to the queue and returns its id."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO jobs (payload, status, max_attempts, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (json.dumps(payload), QUEUED, max_attempts, now, now)
+            )
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def claim(self, worker_id):
+        """
+        Claims the oldest queued job for worker_id.
+
+        Returns:
+            dict or None: The job (id, payload, attempts, ...) or None if the queue is empty.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Reclaim jobs whose worker stopped heartbeating
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires = NULL, updated_at = ?, "
+                "error = 'Lease expired (worker died?)' "
+                "WHERE status = ? AND lease_expires < ? AND attempts < max_attempts",
+                (QUEUED, now, RUNNING, now)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires = NULL, updated_at = ?, "
+                "error = 'Lease expired and no attempts left' "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts",
+                (FAILED, now, RUNNING, now)
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE id = ?",
+                (RUNNING, worker_id, now + self.lease_seconds, now, row['id'])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        job = self._row_to_dict(row)
+        job['status'] = RUNNING
+        job['worker_id'] = worker_id
+        job['attempts'] += 1
+        return job
+
+    def heartbeat(self, job_id, worker_id):
+        """
+        Extends the lease on a running job.
+
+        Returns:
+            bool: False if the job is no longer held by this worker (lease was lost).
+        """
+        now = time.time()
+        return self._write(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = ?",
+            (now + self.lease_seconds, now, job_id, worker_id, RUNNING)
+        ) > 0
+
+    def complete(self, job_id, worker_id):
+        """Marks a job held by worker_id as done."""
+        return self._write(
+            "UPDATE jobs SET status = ?, lease_expires = NULL, error = NULL, updated_at = ? "
+            "WHERE id = ? AND worker_id = ? AND status = ?",
+            (DONE, time.time(), job_id, worker_id, RUNNING)
+        ) > 0
+
+    def fail(self, job_id, worker_id, error, retry=True):
+        """
+        Records a failure. The job goes back to the queue if retry is set and
+        attempts remain, otherwise it is marked failed.
+        """
+        now = time.time()
+        next_status = f"CASE WHEN attempts < max_attempts THEN '{QUEUED}' ELSE '{FAILED}' END" if retry else f"'{FAILED}'"
+        return self._write(
+            f"UPDATE jobs SET status = {next_status}, worker_id = NULL, lease_expires = NULL, error = ?, updated_at = ? "
+            "WHERE id = ? AND worker_id = ? AND status = ?",
+            (str(error), now, job_id, worker_id, RUNNING)
+        ) > 0
+
+    def release(self, job_id, worker_id, error):
+        """
+        Puts a job held by worker_id back in the queue without using up an attempt,
+        for failures caused by the worker itself rather than by the job.
+        """
+        return self._write(
+            "UPDATE jobs SET status = ?, attempts = attempts - 1, worker_id = NULL, lease_expires = NULL, "
+            "error = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = ?",
+            (QUEUED, str(error), time.time(), job_id, worker_id, RUNNING)
+        ) > 0
+
+    def set_output_filename(self, job_id, worker_id, output_filename):
+        """Records in the payload the file a running job writes (scrape jobs only know it once scraped)."""
+        return self._write(
+            "UPDATE jobs SET payload = json_set(payload, '$.output_filename', ?), updated_at = ? "
+            "WHERE id = ? AND worker_id = ? AND status = ?",
+            (output_filename, time.time(), job_id, worker_id, RUNNING)
+        ) > 0
+
+    def latest_for_output(self, output_filename):
+        """Returns the newest job writing to output_filename as a dict, or None."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE json_extract(payload, '$.output_filename') = ? ORDER BY id DESC LIMIT 1",
+                (output_filename,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return self._row_to_dict(row) if row else None
+
+    def get(self, job_id):
+        """Returns a single job as a dict, or None."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._row_to_dict(row) if row else None
+
+    def list_jobs(self, limit=100):
+        """Returns the most recent jobs, newest first."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [self._row_to_dict(row) for row in rows]
+
+    @staticmethod
+    def _row_to_dict(row):
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        return job
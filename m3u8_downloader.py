@@ -2,9 +2,17 @@ import requests
 import m3u8
 import os
 import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin, urlparse, urlunparse, parse_qs, urlencode
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
+from m3u8_downloader_lib import download_m3u8_video
+from page_scraper import resolve_scrape_target, validate_batch_item
 
 # Suppress InsecureRequestWarning for unverified HTTPS requests if needed
 # from requests.packages.urllib3.exceptions import InsecureRequestWarning
@@ -30,7 +38,7 @@ def download_segment(session, segment_url, output_dir, segment_filename, headers
 
 def main(m3u8_url, output_filename):
     """Downloads all segments from an M3U8 playlist and combines them."""
-    temp_dir = "temp_segments"
+    temp_dir = f"temp_segments_{uuid.uuid4().hex[:8]}" # Unique, so concurrent runs don't collide
     os.makedirs(temp_dir, exist_ok=True)
 
     headers = {
@@ -169,13 +177,13 @@ def main(m3u8_url, output_filename):
 
     # Use ffmpeg to concatenate the downloaded segments
     # The -safe 0 option is needed if using relative paths outside the CWD or absolute paths.
-    ffmpeg_command = f'ffmpeg -f concat -safe 0 -i "{concat_list_path}" -c copy "{output_filename}"'
+    ffmpeg_command = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', concat_list_path, '-c', 'copy', output_filename]
     
-    print(f"Executing: {ffmpeg_command}")
+    print(f"Executing: {' '.join(ffmpeg_command)}")
     try:
         # Using os.system might be simpler here, but subprocess offers more control
         import subprocess
-        process = subprocess.run(ffmpeg_command, shell=True, check=True, capture_output=True, text=True)
+        process = subprocess.run(ffmpeg_command, check=True, capture_output=True, text=True)
         print("FFmpeg Output:\n", process.stdout)
         if process.stderr:
              print("FFmpeg Errors:\n", process.stderr)
@@ -204,12 +212,194 @@ def main(m3u8_url, output_filename):
         print(f"Error during cleanup: {e}. Manual cleanup of '{temp_dir}' might be required.")
 
 
+# --- Batch Mode ---
+
+def parse_batch_file(batch_file, output_dir):
+    """
+    Reads a batch file and returns (jobs, skipped_count).
+
+    Two formats are accepted:
+      * one job per line, "<m3u8_url> -> <output.mp4>" ("→" or plain whitespace also
+        work as separators; blank lines and lines starting with '#' are ignored);
+      * the JSON list the web form sends as batch_data ('direct' and 'scrape' items).
+
+    Like the web form, invalid entries are reported and skipped rather than
+    aborting the whole batch.
+    """
+    with open(batch_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    jobs = []
+    skipped_count = 0
+    if content.lstrip().startswith('['):
+        batch_items = json.loads(content)
+        if not isinstance(batch_items, list):
+            raise ValueError("Batch data is not a list.")
+        for item_index, item in enumerate(batch_items):
+            try:
+                job = validate_batch_item(item, item_index)
+            except ValueError as e:
+                print(f"Skipping {e}")
+                skipped_count += 1
+                continue
+            if job['type'] == 'direct':
+                job['output'] = os.path.join(output_dir, job.pop('output_filename'))
+            jobs.append(job)
+        return jobs, skipped_count
+
+    for line_number, line in enumerate(content.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        # Split on the last separator: URLs may contain "->" themselves
+        for separator in ('→', '->', None):
+            parts = [part.strip() for part in line.rsplit(separator, 1)]
+            if len(parts) == 2:
+                break
+        if len(parts) != 2 or not parts[0] or not parts[1]:
+            print(f"Skipping line {line_number}: expected '<m3u8_url> -> <output.mp4>', got: {line}")
+            skipped_count += 1
+            continue
+        # Same URL and filename rules as a direct item from the web form (".mp4" is re-added)
+        m3u8_url, filename = parts
+        if filename.lower().endswith('.mp4'):
+            filename = filename[:-len('.mp4')]
+        try:
+            job = validate_batch_item({'type': 'direct', 'm3u8_url': m3u8_url, 'filename': filename}, line_number)
+        except ValueError as e:
+            print(f"Skipping line {line_number}: {e}")
+            skipped_count += 1
+            continue
+        jobs.append({'type': 'direct', 'm3u8_url': m3u8_url, 'output': os.path.join(output_dir, job['output_filename'])})
+    return jobs, skipped_count
+
+def _run_batch_job(job, output_dir, session, segment_executor, max_in_flight, include_subtitles=False):
+    """Downloads one batch job and returns a result dict for the summary report."""
+    source = job.get('m3u8_url') or job.get('page_url')
+    result = {'source': source, 'output': job.get('output'), 'ok': False, 'error': None,
+              'segments': 0, 'failed_segments': 0, 'bytes': 0, 'seconds': 0.0}
+    start_time = time.time()
+    try:
+        m3u8_url = job.get('m3u8_url')
+        if job['type'] == 'scrape':
+            m3u8_url, output_filename = resolve_scrape_target(job['page_url'], job['item_index'])
+            result['output'] = os.path.join(output_dir, output_filename)
+        stats = {}
+        try:
+            download_m3u8_video(m3u8_url, os.path.abspath(result['output']), include_subtitles=include_subtitles,
+                                session=session, executor=segment_executor, max_in_flight=max_in_flight, stats=stats)
+            result['ok'] = True
+        finally:
+            result.update(stats)
+    except Exception as e:
+        result['error'] = str(e)
+        print(f"\nError downloading {source}: {e}")
+    result['seconds'] = time.time() - start_time
+    return result
+
+def _print_batch_summary(results, wall_seconds, skipped_count=0):
+    """Prints per-job results and the aggregate throughput of the batch."""
+    print("\n=== Batch summary ===")
+    for result in results:
+        megabytes = result['bytes'] / (1024 * 1024)
+        rate = megabytes / result['seconds'] if result['seconds'] else 0
+        status = "ok" if result['ok'] else "FAILED"
+        print(f"[{status:>6}] {result['output'] or result['source']}: {result['segments']} segments "
+              f"({result['failed_segments']} failed), {megabytes:.1f} MB in {result['seconds']:.1f}s ({rate:.2f} MB/s)")
+        if result['error']:
+            print(f"         {result['error']}")
+
+    succeeded = sum(1 for result in results if result['ok'])
+    total_megabytes = sum(result['bytes'] for result in results) / (1024 * 1024)
+    total_segments = sum(result['segments'] - result['failed_segments'] for result in results)
+    wall_seconds = wall_seconds or 1e-9
+    print(f"Jobs: {succeeded}/{len(results)} succeeded" + (f", {skipped_count} invalid entries skipped" if skipped_count else ""))
+    print(f"Downloaded {total_megabytes:.1f} MB ({total_segments} segments) in {wall_seconds:.1f}s wall time: "
+          f"{total_megabytes / wall_seconds:.2f} MB/s, {total_segments / wall_seconds:.1f} segments/s")
+
+def batch_main(batch_file, output_dir='.', max_workers=10, max_jobs=4, include_subtitles=False):
+    """
+    Downloads every job in batch_file through one shared session and segment pool.
+
+    Args:
+        batch_file (str): Path to a line-based or JSON batch file (see parse_batch_file).
+        output_dir (str): Directory relative outputs and generated filenames are placed in.
+        max_workers (int): Global number of concurrent segment downloads across all jobs.
+        max_jobs (int): Number of playlists processed at the same time.
+        include_subtitles (bool): Also download the default WebVTT subtitle rendition of each playlist.
+
+    Returns:
+        bool: True if every job succeeded.
+    """
+    try:
+        jobs, skipped_count = parse_batch_file(batch_file, output_dir)
+    except (OSError, ValueError) as e:
+        print(f"Error reading batch file {batch_file}: {e}")
+        return False
+    if not jobs:
+        print(f"No valid jobs found in {batch_file}.")
+        return False
+    print(f"Loaded {len(jobs)} jobs. Running {min(max_jobs, len(jobs))} at a time with {max_workers} shared segment workers.")
+
+    # Each running job may keep only its share of the segment pool busy, so one long
+    # playlist can't starve the others; the share grows as other jobs finish
+    active_jobs = [0]
+    active_lock = threading.Lock()
+    def max_in_flight():
+        return max(1, max_workers // max(1, active_jobs[0]))
+    def run_job(job):
+        with active_lock:
+            active_jobs[0] += 1
+        try:
+            return _run_batch_job(job, output_dir, session, segment_executor, max_in_flight, include_subtitles)
+        finally:
+            with active_lock:
+                active_jobs[0] -= 1
+
+    # One connection pool sized for the global budget (+ playlist fetches from job threads)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max(10, max_jobs), pool_maxsize=max_workers + max_jobs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='segment') as segment_executor, \
+         ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='job') as job_executor:
+        # Each job gets its own unique temp directory inside download_m3u8_video
+        results = list(job_executor.map(run_job, jobs))
+    _print_batch_summary(results, time.time() - start_time, skipped_count)
+    return all(result['ok'] for result in results)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python m3u8_downloader.py <m3u8_url> <output_filename.mp4>")
+    parser = argparse.ArgumentParser(
+        description="Download an M3U8 playlist to MP4, or many playlists with --batch.",
+        usage="%(prog)s <m3u8_url> <output_filename.mp4>\n       %(prog)s --batch <file> [--workers N] [--jobs N] [--output-dir DIR] [--subtitles]"
+    )
+    parser.add_argument('m3u8_url', nargs='?')
+    parser.add_argument('output_filename', nargs='?')
+    parser.add_argument('--batch', metavar='FILE',
+                        help="File with one '<m3u8_url> -> <output.mp4>' per line, or the web form's batch_data JSON.")
+    parser.add_argument('--workers', type=int, default=10, help="Concurrent segment downloads shared by all batch jobs (default: 10).")
+    parser.add_argument('--jobs', type=int, default=4, help="Playlists processed at the same time in batch mode (default: 4).")
+    parser.add_argument('--output-dir', default='.', help="Directory for batch outputs (default: current directory).")
+    parser.add_argument('--subtitles', action='store_true',
+                        help="In batch mode, also mux each playlist's default WebVTT subtitle rendition into the MP4.")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1.")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+
+    if args.batch:
+        if args.m3u8_url:
+            parser.error("--batch cannot be combined with a single m3u8_url.")
+        sys.exit(0 if batch_main(args.batch, args.output_dir, args.workers, args.jobs, args.subtitles) else 1)
+    if args.subtitles:
+        parser.error("--subtitles is only supported together with --batch.")
+
+    if not args.m3u8_url or not args.output_filename:
+        parser.print_usage()
         sys.exit(1)
-    
-    m3u8_url_arg = sys.argv[1]
-    output_filename_arg = sys.argv[2]
-    
-    main(m3u8_url_arg, output_filename_arg)
\ No newline at end of file
+
+    main(args.m3u8_url, args.output_filename)
@@ -1,12 +1,20 @@
 import requests
 import m3u8
 import os
+import re
 import sys
+import shlex
 import subprocess
 import shutil
 import uuid # For generating unique temp dir names
+from contextlib import nullcontext
 from urllib.parse import urljoin, urlparse, urlunparse, parse_qs, urlencode
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Suffix of the in-progress, playable copy written when progressive output is requested
+PARTIAL_SUFFIX = '.part.ts'
+# LANGUAGE values from the playlist are only passed to ffmpeg if they look like BCP-47 tags
+LANGUAGE_TAG_PATTERN = re.compile(r'^[A-Za-z0-9]{1,8}(-[A-Za-z0-9]{1,8})*$')
 
 # --- Custom Exception ---
 class DownloaderError(Exception):
@@ -15,6 +23,15 @@ class DownloaderError(Exception):
 
 # --- Helper Functions ---
 
+def _check_cancelled(cancel_event):
+    """Raises DownloaderError if the caller asked for the download to stop."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise DownloaderError("Download cancelled.")
+
+def partial_output_path(output_filepath):
+    """Returns the path of the in-progress TS file for output_filepath."""
+    return output_filepath + PARTIAL_SUFFIX
+
 def _download_segment(session, segment_url, output_dir, segment_filename, headers, verify_ssl=True):
     """Downloads a single video segment using the provided session."""
     filepath = os.path.join(output_dir, segment_filename)
@@ -33,15 +50,16 @@ def _download_segment(session, segment_url, output_dir, segment_filename, header
         print(f"Error writing segment {segment_filename}: {e}") # Log error
         return None # Indicate failure
 
-def _cleanup_temp_files(temp_dir, downloaded_files, concat_list_path):
-    """Cleans up temporary segment files and the concat list."""
+def _cleanup_temp_files(temp_dir, downloaded_files, extra_files):
+    """Cleans up temporary segment files, concat lists and other intermediate files."""
     print(f"Cleaning up temporary files in {temp_dir}...")
     try:
         for segment_file in downloaded_files:
              if segment_file and os.path.exists(segment_file): # Check if path is not None
                  os.remove(segment_file)
-        if os.path.exists(concat_list_path):
-             os.remove(concat_list_path)
+        for extra_file in extra_files:
+             if os.path.exists(extra_file):
+                 os.remove(extra_file)
         # Only remove temp_dir if it exists and is empty (safer)
         if os.path.exists(temp_dir) and not os.listdir(temp_dir):
              os.rmdir(temp_dir)
@@ -52,15 +70,186 @@ def _cleanup_temp_files(temp_dir, downloaded_files, concat_list_path):
         print(f"Error during cleanup: {e}. Manual cleanup of '{temp_dir}' might be required.")
         # Don't raise an exception here, just log the cleanup issue
 
+def _with_original_query(url, original_query_params):
+    """Returns url with the original playlist's query params merged in (url's own take precedence)."""
+    parsed_url = urlparse(url)
+    merged_query_params = {**original_query_params, **parse_qs(parsed_url.query)}
+    url_parts = list(parsed_url)
+    url_parts[4] = urlencode(merged_query_params, doseq=True)
+    return urlunparse(url_parts)
+
+def _fetch_playlist(session, url, headers, verify_ssl):
+    """Fetches and parses a playlist."""
+    playlist_response = session.get(url, headers=headers, timeout=15, verify=verify_ssl)
+    playlist_response.raise_for_status()
+    return m3u8.loads(playlist_response.text, uri=url)
+
+def _select_rendition(master_playlist, media_type, group_id):
+    """
+    Picks one EXT-X-MEDIA rendition of media_type from group_id.
+
+    Prefers DEFAULT=YES, then AUTOSELECT=YES, then the first listed. Renditions
+    without a URI are carried inside the variant stream itself and are ignored.
+    """
+    candidates = [
+        media for media in master_playlist.media
+        if media.type == media_type and media.group_id == group_id and media.uri
+    ]
+    if not candidates:
+        return None
+    for attribute in ('default', 'autoselect'):
+        for media in candidates:
+            if (getattr(media, attribute) or '').upper() == 'YES':
+                return media
+    return candidates[0]
+
+_MPEGTS_CLOCK = 90000 # MPEG-TS timestamps tick at 90 kHz
+_MPEGTS_WRAP = 2 ** 33 # ... and wrap around after 33 bits
+_VTT_TIME_RE = re.compile(r'(?:(\d+):)?(\d{2}):(\d{2})\.(\d{3})')
+
+def _parse_vtt_time(text):
+    hours, minutes, seconds, millis = _VTT_TIME_RE.fullmatch(text.strip()).groups()
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(millis) / 1000
+
+def _format_vtt_time(seconds):
+    millis = max(0, round(seconds * 1000))
+    return f"{millis // 3600000:02d}:{millis // 60000 % 60:02d}:{millis // 1000 % 60:02d}.{millis % 1000:03d}"
+
+def _parse_timestamp_map(header):
+    """Returns (mpegts_ticks, local_seconds) from a segment's X-TIMESTAMP-MAP, or None."""
+    for line in header.split('\n'):
+        if line.startswith('X-TIMESTAMP-MAP='):
+            fields = dict(field.split(':', 1) for field in line[len('X-TIMESTAMP-MAP='):].split(',') if ':' in field)
+            try:
+                return int(fields['MPEGTS']), _parse_vtt_time(fields['LOCAL'])
+            except (KeyError, ValueError, AttributeError):
+                return None
+    return None
+
+def _probe_start_time(path):
+    """Returns the start time (seconds) ffprobe reports for a media file, or None."""
+    command = ['ffprobe', '-v', 'error', '-show_entries', 'format=start_time',
+               '-of', 'default=noprint_wrappers=1:nokey=1', path]
+    try:
+        process = subprocess.run(command, check=False, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+        return float(process.stdout.strip())
+    except (OSError, ValueError):
+        return None
+
+def _merge_webvtt_segments(segment_files, output_path, video_start=None):
+    """
+    Joins WebVTT segments into one file, with cue times relative to the start of the video.
+
+    HLS cue times are in each segment's local timeline. Its X-TIMESTAMP-MAP header ties
+    that to the MPEG-TS clock (LOCAL time == MPEGTS ticks). The concat demuxer rebases the
+    video so its first PTS (video_start, in seconds) becomes 0. Each cue is therefore shifted
+    by (MPEGTS / 90000 - LOCAL) - video_start. Segments without a map reuse the previous
+    one; if no segment has one, cue times are kept as they are.
+    """
+    timestamp_map = None
+    start_ticks = round(video_start * _MPEGTS_CLOCK) if video_start is not None else None
+    with open(output_path, 'w', encoding='utf-8') as out:
+        out.write("WEBVTT\n\n")
+        for segment_file in segment_files:
+            with open(segment_file, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read().replace('\r\n', '\n')
+            # The header block (WEBVTT line, X-TIMESTAMP-MAP etc.) ends at the first blank line
+            header, _, cues = content.partition('\n\n')
+            timestamp_map = _parse_timestamp_map(header) or timestamp_map
+            if not cues.strip():
+                continue
+
+            shift = 0.0
+            if timestamp_map:
+                mpegts, local = timestamp_map
+                if start_ticks is None:
+                    # No probed video start: assume the first mapped segment lines up with it
+                    start_ticks = mpegts
+                # Signed difference modulo the 33-bit wrap
+                ticks = (mpegts - start_ticks) % _MPEGTS_WRAP
+                if ticks >= _MPEGTS_WRAP // 2:
+                    ticks -= _MPEGTS_WRAP
+                shift = ticks / _MPEGTS_CLOCK - local
+
+            lines = []
+            for line in cues.strip('\n').split('\n'):
+                if '-->' in line:
+                    start, _, rest = line.partition('-->')
+                    end, _, settings = rest.strip().partition(' ')
+                    try:
+                        line = f"{_format_vtt_time(_parse_vtt_time(start) + shift)} --> {_format_vtt_time(_parse_vtt_time(end) + shift)}"
+                    except AttributeError: # Not a valid timing line; keep it untouched
+                        pass
+                    else:
+                        if settings:
+                            line += f" {settings}"
+                lines.append(line)
+            out.write('\n'.join(lines) + "\n\n")
+
+class _OrderedSegmentWriter:
+    """
+    Appends video segments to a single TS file in playlist order as they finish.
+
+    Segments complete out of order, so each one is held back until every earlier
+    segment has been written. The file is therefore always a playable prefix of
+    the stream and can be served while the download is still running.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.next_index = 0
+        self.pending = {}
+        self.file = open(path, 'wb')
+
+    def add(self, index, segment_file):
+        """Registers segment index (None if it failed) and flushes any ready prefix."""
+        self.pending[index] = segment_file
+        while self.next_index in self.pending:
+            ready_file = self.pending.pop(self.next_index)
+            if ready_file: # Failed segments are skipped, leaving a gap in the stream
+                with open(ready_file, 'rb') as f:
+                    shutil.copyfileobj(f, self.file)
+                self.file.flush()
+            self.next_index += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
 # --- Main Download Function ---
 
-def download_m3u8_video(m3u8_url, output_filepath):
+def download_m3u8_video(m3u8_url, output_filepath, include_audio=True, include_subtitles=False, progressive_path=None,
+                        session=None, executor=None, max_in_flight=None, stats=None, cancel_event=None):
     """
     Downloads all segments from an M3U8 playlist and combines them into a single file.
 
+    For master playlists, the alternate audio (and optionally subtitle) renditions
+    referenced by the selected variant through EXT-X-MEDIA are downloaded alongside
+    the video, sharing one segment thread pool, and muxed in a single ffmpeg pass.
+
     Args:
         m3u8_url (str): The URL of the M3U8 playlist (master or media).
         output_filepath (str): The full path where the final MP4 file should be saved.
+        include_audio (bool): Download the variant's separate audio rendition, if any.
+        include_subtitles (bool): Download the variant's WebVTT subtitle rendition, if any.
+        progressive_path (str, optional): If given, the video segments are also appended here
+            in order as they arrive, producing a TS file that can be served before the final
+            MP4 exists. The file is removed once the download finishes or fails.
+        session (requests.Session, optional): Session to reuse, e.g. one shared connection
+            pool across several downloads. A new session is created if omitted.
+        executor (concurrent.futures.Executor, optional): Pool to submit segment downloads to,
+            so several concurrent downloads share one concurrency budget. If omitted, a
+            private 10-thread pool is used.
+        max_in_flight (int or callable, optional): Most segments of this download queued or
+            running in the pool at once (default 10). Set it to this download's share of a
+            shared pool; a callable is re-evaluated as segments finish, so the share can grow
+            when other downloads end.
+        stats (dict, optional): If given, filled with 'segments', 'failed_segments' and
+            'bytes' (segment bytes downloaded) for throughput reporting.
+        cancel_event (threading.Event, optional): When set, the download stops at the next
+            checkpoint, no output is published and the progressive file is left alone
+            (it may already belong to another run of the same job; the caller decides
+            whether to remove it, see worker.py).
 
     Raises:
         DownloaderError: If any critical step fails (fetching, parsing, combining).
@@ -72,30 +261,33 @@ def download_m3u8_video(m3u8_url, output_filepath):
     os.makedirs(temp_dir, exist_ok=True)
     print(f"Using temporary directory: {temp_dir}") # Log the temp dir being used
     downloaded_files = [] # Keep track of successfully downloaded segment file paths
-    concat_list_path = os.path.join(temp_dir, "concat_list.txt")
+    intermediate_files = [] # Concat lists and merged subtitle files
+    progressive_writer = None
 
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
         'Referer': m3u8_url
     }
     verify_ssl = True
-    session = requests.Session()
-    session.headers.update(headers)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(headers)
+    # Per-request headers are passed explicitly, so a shared session is never mutated
 
     try:
         print(f"Fetching M3U8 playlist from: {m3u8_url}")
         original_parsed_url = urlparse(m3u8_url)
         original_query_params = parse_qs(original_parsed_url.query)
 
-        playlist_response = session.get(m3u8_url, timeout=15, verify=verify_ssl)
-        playlist_response.raise_for_status()
-        playlist_content = playlist_response.text
-        playlist = m3u8.loads(playlist_content, uri=m3u8_url)
+        playlist = _fetch_playlist(session, m3u8_url, headers, verify_ssl)
+        # (track name, media type, EXT-X-MEDIA rendition or None for the main stream)
+        renditions = []
 
         # Handle master playlist
         if playlist.is_variant:
             print("Master playlist detected. Selecting best stream (or first).") # Simplified selection
-            selected_playlist = playlist.playlists[0] # Default to first/lowest quality
+            master_playlist = playlist
+            selected_playlist = master_playlist.playlists[0] if master_playlist.playlists else None # Default to first/lowest quality
             # TODO: Add logic to select based on desired quality if needed
             # For now, just take the first one listed
             
@@ -105,73 +297,169 @@ def download_m3u8_video(m3u8_url, output_filepath):
             print(f"Selected stream URI: {selected_playlist.uri}")
             
             # Construct the media playlist URL, preserving original query params
-            media_parsed_url = urlparse(selected_playlist.absolute_uri)
-            media_query_params = parse_qs(media_parsed_url.query)
-            merged_query_params = {**original_query_params, **media_query_params}
-            final_media_url_parts = list(media_parsed_url)
-            final_media_url_parts[4] = urlencode(merged_query_params, doseq=True)
-            final_media_url = urlunparse(final_media_url_parts)
-
+            final_media_url = _with_original_query(selected_playlist.absolute_uri, original_query_params)
             print(f"Fetching selected media playlist: {final_media_url}")
-            playlist_response = session.get(final_media_url, timeout=15, verify=verify_ssl)
-            playlist_response.raise_for_status()
-            playlist = m3u8.loads(playlist_response.text, uri=final_media_url) # Update playlist object
+            playlist = _fetch_playlist(session, final_media_url, headers, verify_ssl) # Update playlist object
+
+            stream_info = selected_playlist.stream_info
+            if include_audio and stream_info.audio:
+                renditions.append(('audio', _select_rendition(master_playlist, 'AUDIO', stream_info.audio)))
+            if include_subtitles and stream_info.subtitles:
+                renditions.append(('subtitles', _select_rendition(master_playlist, 'SUBTITLES', stream_info.subtitles)))
+            renditions = [(name, media) for name, media in renditions if media]
 
         # Check for segments in the (now guaranteed) media playlist
         if not playlist.segments:
             raise DownloaderError("No video segments found in the final M3U8 playlist.")
 
-        segment_urls = [urljoin(playlist.base_uri, segment.uri) for segment in playlist.segments]
-        total_segments = len(segment_urls)
-        print(f"Found {total_segments} segments.")
+        # Every track's segments go through the same pool, so renditions add no wall time
+        tracks = [('video', [urljoin(playlist.base_uri, segment.uri) for segment in playlist.segments])]
+        for name, media in renditions:
+            media_url = _with_original_query(media.absolute_uri, original_query_params)
+            print(f"Fetching {name} rendition playlist ({media.language or media.name or 'unnamed'}): {media_url}")
+            rendition_playlist = _fetch_playlist(session, media_url, headers, verify_ssl)
+            if not rendition_playlist.segments:
+                print(f"Warning: {name} rendition has no segments, skipping it.")
+                continue
+            tracks.append((name, [urljoin(rendition_playlist.base_uri, segment.uri) for segment in rendition_playlist.segments]))
+        rendition_by_name = dict(renditions)
+
+        total_segments = sum(len(segment_urls) for _, segment_urls in tracks)
+        print(f"Found {total_segments} segments ({', '.join(f'{name}: {len(urls)}' for name, urls in tracks)}).")
+
+        _check_cancelled(cancel_event)
+        if progressive_path:
+            os.makedirs(os.path.dirname(progressive_path), exist_ok=True)
+            progressive_writer = _OrderedSegmentWriter(progressive_path)
+            print(f"Writing in-progress stream to: {progressive_path}")
 
         # Download segments
         max_workers = 10
         failed_segments = 0
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {
-                executor.submit(_download_segment, session, url, temp_dir, f"segment_{i:05d}.ts", headers, verify_ssl): i
-                for i, url in enumerate(segment_urls)
-            }
+        track_files = {name: [] for name, _ in tracks}
+        # A caller-supplied pool is shared with other downloads and must not be shut down here
+        # Interleave tracks so renditions download alongside the video, not after it
+        work_items = iter(sorted(
+            ((i, name, url) for name, segment_urls in tracks for i, url in enumerate(segment_urls)),
+            key=lambda item: item[0]
+        ))
+        with (nullcontext(executor) if executor else ThreadPoolExecutor(max_workers=max_workers)) as segment_executor:
+            in_flight = {}
             print(f"Downloading {total_segments} segments...")
             # Basic progress indication without tqdm
             completed_count = 0
-            for future in as_completed(futures):
-                result = future.result()
-                completed_count += 1
-                if result:
-                    downloaded_files.append(result)
-                else:
-                    failed_segments += 1
-                print(f"Progress: {completed_count}/{total_segments} segments processed ({failed_segments} failed).", end='\r')
+            while True:
+                # Keep at most `window` of this download's segments queued or running, so a
+                # shared pool is split between concurrent downloads instead of drained by one
+                window = (max_in_flight() if callable(max_in_flight) else max_in_flight) or max_workers
+                while len(in_flight) < window:
+                    item = next(work_items, None)
+                    if item is None:
+                        break
+                    i, name, url = item
+                    future = segment_executor.submit(_download_segment, session, url, temp_dir, f"{name}_{i:05d}.ts", headers, verify_ssl)
+                    in_flight[future] = (name, i)
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                if cancel_event is not None and cancel_event.is_set():
+                    for pending_future in in_flight:
+                        pending_future.cancel()
+                    # Segments already running still land in temp_dir; track them for cleanup
+                    for pending_future in in_flight:
+                        if not pending_future.cancelled() and pending_future.result() not in downloaded_files:
+                            downloaded_files.append(pending_future.result())
+                    _check_cancelled(cancel_event)
+                for future in done:
+                    name, index = in_flight.pop(future)
+                    result = future.result()
+                    completed_count += 1
+                    if result:
+                        downloaded_files.append(result)
+                        track_files[name].append(result)
+                    else:
+                        failed_segments += 1
+                    if progressive_writer and name == 'video':
+                        progressive_writer.add(index, result)
+                    print(f"Progress: {completed_count}/{total_segments} segments processed ({failed_segments} failed).", end='\r')
         print("\nSegment download phase complete.") # Newline after progress indicator
 
         if failed_segments > 0:
              print(f"Warning: {failed_segments} out of {total_segments} segments failed to download.")
              # Decide whether to proceed or fail based on threshold? For now, proceed if any downloaded.
         
-        if not downloaded_files:
+        if stats is not None:
+            stats['segments'] = total_segments
+            stats['failed_segments'] = failed_segments
+            stats['bytes'] = sum(os.path.getsize(segment_file) for segment_file in downloaded_files)
+
+        if not track_files['video']:
              raise DownloaderError("No segments were downloaded successfully.")
 
-        # Ensure files are sorted correctly
-        downloaded_files.sort()
+        # Build one ffmpeg input per track
+        print("Creating ffmpeg concat lists...")
+        active_tracks = [name for name, _ in tracks if track_files[name]]
+        ffmpeg_inputs = [] # One argument list per input; the list index is the ffmpeg input index
+        ffmpeg_options = []
+        for name, _ in tracks:
+            segment_files = sorted(track_files[name]) # Ensure files are sorted correctly
+            if not segment_files:
+                print(f"Warning: No {name} segments were downloaded, leaving that track out.")
+                continue
+            input_index = len(ffmpeg_inputs)
+
+            if name == 'subtitles':
+                merged_path = os.path.join(temp_dir, "subtitles.vtt")
+                # Subtitle times are mapped onto the rebased video timeline via its first PTS
+                video_start = _probe_start_time(sorted(track_files['video'])[0])
+                if video_start is None:
+                    print("Warning: Could not probe the video start time; subtitle timing may be off.")
+                _merge_webvtt_segments(segment_files, merged_path, video_start)
+                intermediate_files.append(merged_path)
+                ffmpeg_inputs.append(['-i', merged_path])
+            else:
+                concat_list_path = os.path.join(temp_dir, f"{name}_concat_list.txt")
+                with open(concat_list_path, 'w', encoding='utf-8') as f:
+                    for segment_file in segment_files:
+                        absolute_path = os.path.abspath(segment_file).replace('\\', '/')
+                        f.write(f"file '{absolute_path}'\n")
+                intermediate_files.append(concat_list_path)
+                ffmpeg_inputs.append(['-f', 'concat', '-safe', '0', '-i', concat_list_path])
 
-        # Create concat list
-        print("Creating ffmpeg concat list...")
-        with open(concat_list_path, 'w', encoding='utf-8') as f:
-            for segment_file in downloaded_files:
-                absolute_path = os.path.abspath(segment_file).replace('\\', '/')
-                f.write(f"file '{absolute_path}'\n")
+            if len(active_tracks) > 1:
+                # Explicit maps so the audio rendition replaces any audio muxed into the variant
+                stream_type = {'video': 'v', 'audio': 'a', 'subtitles': 's'}[name]
+                ffmpeg_options += ['-map', f'{input_index}:{stream_type}']
+                if name == 'video' and 'audio' not in active_tracks:
+                    ffmpeg_options += ['-map', f'{input_index}:a?']
+                language = rendition_by_name[name].language if name in rendition_by_name else None
+                if language and LANGUAGE_TAG_PATTERN.match(language):
+                    ffmpeg_options += [f'-metadata:s:{stream_type}:0', f'language={language}']
+                elif language:
+                    print(f"Warning: Ignoring invalid LANGUAGE attribute on the {name} rendition: {language!r}")
+        ffmpeg_options += ['-c', 'copy']
+        if track_files.get('subtitles'):
+            ffmpeg_options += ['-c:s', 'mov_text'] # MP4 cannot hold WebVTT; this converts text only
 
         # Combine using ffmpeg
         print("Combining segments with ffmpeg...")
         # Ensure output directory exists
         os.makedirs(os.path.dirname(output_filepath), exist_ok=True) 
-        ffmpeg_command = f'ffmpeg -y -f concat -safe 0 -i "{concat_list_path}" -c copy "{output_filepath}"' # Added -y to overwrite
-        print(f"Executing: {ffmpeg_command}")
+        # Mux next to the target and rename at the end, so a half-written MP4 is never served
+        output_base, output_ext = os.path.splitext(output_filepath)
+        # Unique per run, so a superseded run of the same job can't write into our file
+        muxing_filepath = f"{output_base}.muxing-{uuid.uuid4().hex[:8]}{output_ext}"
+        intermediate_files.append(muxing_filepath)
+        # Argument list, no shell: paths and playlist attributes are never parsed as shell syntax
+        ffmpeg_command = ['ffmpeg', '-y'] # Added -y to overwrite
+        for input_args in ffmpeg_inputs:
+            ffmpeg_command += input_args
+        ffmpeg_command += ffmpeg_options + [muxing_filepath]
+        print(f"Executing: {shlex.join(ffmpeg_command)}")
         
         # Specify encoding and error handling for ffmpeg output
-        process = subprocess.run(ffmpeg_command, shell=True, check=False, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+        # A missing ffmpeg binary raises FileNotFoundError here, re-raised below
+        process = subprocess.run(ffmpeg_command, check=False, capture_output=True, text=True, encoding='utf-8', errors='ignore')
         
         if process.returncode != 0:
              print("FFmpeg Output:\n", process.stdout)
@@ -180,6 +468,9 @@ def download_m3u8_video(m3u8_url, output_filepath):
         else:
              print("FFmpeg Output:\n", process.stdout) # Log success output too
              if process.stderr: print("FFmpeg Errors/Warnings:\n", process.stderr)
+             # Last check before publishing: a superseded run must not replace the output
+             _check_cancelled(cancel_event)
+             os.replace(muxing_filepath, output_filepath)
              print(f"Video successfully combined into {output_filepath}")
              return True # Indicate success
 
@@ -223,6 +514,11 @@ def download_m3u8_video(m3u8_url, output_filepath):
         raise DownloaderError(f"An unexpected error occurred: {e}") from e
     finally:
         # Ensure cleanup happens even if errors occurred
-        _cleanup_temp_files(temp_dir, downloaded_files, concat_list_path)
+        if progressive_writer:
+            # Readers already streaming it keep their open handle; new requests get the MP4
+            progressive_writer.close()
+            if cancel_event is None or not cancel_event.is_set():
+                intermediate_files.append(progressive_path)
+        _cleanup_temp_files(temp_dir, downloaded_files, intermediate_files)
 
 # Note: The if __name__ == "__main__": block is removed as this is now a library.
\ No newline at end of file
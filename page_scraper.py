@@ -0,0 +1,196 @@
+import re
+import time
+from urllib.parse import urljoin
+from m3u8_downloader_lib import DownloaderError
+
+class PlaylistNotFoundError(DownloaderError):
+    """Raised when a scraped page contains no M3U8 link."""
+    pass
+
+class ScrapeError(DownloaderError):
+    """Raised when a page could not be scraped at all (browser, timeout or network error)."""
+    pass
+
+# --- Playwright Scraping Function ---
+# NOTE: This runs synchronously and launches a browser per call. It is executed by the
+# queue workers (see worker.py), never in the Flask request thread.
+def scrape_page_for_m3u8(page_url):
+    """
+    Uses Playwright to load a page, find title and first M3U8 network request.
+
+    Returns:
+        tuple: (page_title, m3u8_url), where m3u8_url is None if the page loaded but had no link.
+
+    Raises:
+        ScrapeError: If the browser failed or the page could not be loaded; worth retrying.
+    """
+    # Import here so the filename helpers below work without Playwright installed
+    from playwright.sync_api import sync_playwright, Error as PlaywrightError
+    m3u8_url_found = None
+    page_title = None
+    print(f"  [Playwright] Launching browser for {page_url}")
+
+    # Using a context manager ensures the browser is closed properly
+    with sync_playwright() as p:
+        try:
+            # Launch headless browser (Chromium is often a good default)
+            # Use a realistic user agent
+            user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            browser = p.chromium.launch(headless=True)
+            context = browser.new_context(user_agent=user_agent)
+            page = context.new_page()
+
+            # --- Network Interception ---
+            # Use a list to store the found URL (accessible from inner scope)
+            found_urls = []
+            def handle_request(route, request):
+                 if ".m3u8" in request.url and not found_urls: # Find first m3u8 request
+                     print(f"  [Playwright] Intercepted M3U8 request: {request.url}")
+                     found_urls.append(request.url)
+                 route.continue_() # Let the request proceed
+
+            # Start routing *before* navigation
+            page.route("**/*", handle_request)
+
+            # --- Navigation and Waiting ---
+            print(f"  [Playwright] Navigating to {page_url}")
+            # Increased timeout for potentially slow pages
+            page.goto(page_url, timeout=60000, wait_until='networkidle')
+            # Alternative wait: page.wait_for_timeout(5000) # Wait fixed time after load
+
+            print(f"  [Playwright] Page loaded. Checking for title and intercepted URL.")
+            page_title = page.title()
+
+            # Check if the handler found an M3U8 URL
+            if found_urls:
+                m3u8_url_found = found_urls[0]
+
+            # Fallback: If network interception didn't find it, try simple HTML check again
+            # (Sometimes it might be in the initial source after all)
+            if not m3u8_url_found:
+                 print("  [Playwright] M3U8 not found in network requests, checking HTML source as fallback...")
+                 # Import here as it's only needed for the fallback
+                 from bs4 import BeautifulSoup
+                 content = page.content()
+                 soup = BeautifulSoup(content, 'html.parser')
+                 for tag in soup.find_all(['video', 'source']):
+                     src = tag.get('src')
+                     if src and '.m3u8' in src:
+                         m3u8_url_found = urljoin(page_url, src)
+                         print(f"  [Playwright] Found M3U8 in HTML <{tag.name} src>: {m3u8_url_found}")
+                         break
+                 if not m3u8_url_found:
+                     for tag in soup.find_all('a'):
+                         href = tag.get('href')
+                         if href and '.m3u8' in href:
+                             m3u8_url_found = urljoin(page_url, href)
+                             print(f"  [Playwright] Found M3U8 in HTML <a href>: {m3u8_url_found}")
+                             break
+
+            browser.close()
+            print(f"  [Playwright] Browser closed for {page_url}")
+
+        except PlaywrightError as e:
+            print(f"  [Playwright Error] Error during scraping {page_url}: {e}")
+            # Ensure browser is closed if it exists and wasn't closed yet
+            if 'browser' in locals() and browser.is_connected():
+                 browser.close()
+            raise ScrapeError(f"Error during scraping {page_url}: {e}") from e
+        except Exception as e:
+             print(f"  [Playwright Error] Unexpected error during scraping {page_url}: {e}")
+             if 'browser' in locals() and browser.is_connected():
+                 browser.close()
+             raise ScrapeError(f"Unexpected error during scraping {page_url}: {e}") from e
+
+    return page_title, m3u8_url_found
+
+
+# --- Filename Sanitization ---
+def sanitize_filename(name):
+    """Removes invalid characters for filenames and limits length."""
+    # Remove invalid characters (Windows example, adjust for cross-platform if needed)
+    name = re.sub(r'[\\/*?:"<>|]', "", name)
+    # Replace sequences of whitespace with a single underscore
+    name = re.sub(r'\s+', '_', name)
+    # Limit length (optional)
+    max_len = 150
+    if len(name) > max_len:
+        name = name[:max_len]
+    # Ensure it's not empty or just dots after sanitization
+    if not name or set(name) == {'.'}:
+        return None
+    return name
+
+def is_valid_m3u8_url(url):
+    """Relaxed check: http(s) URL with '.m3u8' somewhere before any '?'."""
+    return bool(url) and url.startswith(('http://', 'https://')) and '.m3u8' in url.split('?')[0]
+
+def validate_batch_item(item, item_index):
+    """
+    Turns one item of the web form's batch_data into a job payload.
+
+    Returns:
+        dict: {'type': 'scrape', 'page_url', 'item_index'} or
+              {'type': 'direct', 'm3u8_url', 'output_filename'}.
+
+    Raises:
+        ValueError: Describing why the item should be skipped.
+    """
+    if not isinstance(item, dict) or 'type' not in item:
+        raise ValueError(f"invalid batch item format (missing type): {item}")
+
+    item_type = item.get('type')
+    if item_type == 'scrape':
+        page_url = str(item.get('page_url') or '').strip()
+        if not page_url.startswith(('http://', 'https://')):
+            raise ValueError(f"scrape item with invalid page URL: {page_url}")
+        # Scraping launches a browser, so it is left to whoever runs the job
+        return {'type': 'scrape', 'page_url': page_url, 'item_index': item_index}
+
+    if item_type == 'direct':
+        m3u8_url = str(item.get('m3u8_url') or '').strip()
+        desired_filename_base = str(item.get('filename') or '').strip()
+        if not is_valid_m3u8_url(m3u8_url):
+            raise ValueError(f"direct item with invalid M3U8 URL format: {m3u8_url}")
+        if not desired_filename_base:
+            raise ValueError(f"direct item with missing filename for URL: {m3u8_url}")
+        sanitized_base = sanitize_filename(desired_filename_base)
+        if not sanitized_base:
+            raise ValueError(f"direct item with invalid desired filename after sanitization: {desired_filename_base}")
+        return {'type': 'direct', 'm3u8_url': m3u8_url, 'output_filename': sanitized_base + ".mp4"}
+
+    raise ValueError(f"item with unknown type: {item_type}")
+
+def resolve_scrape_target(page_url, item_index=0):
+    """
+    Scrapes page_url and returns (m3u8_url, output_filename) for downloading it.
+
+    The filename comes from the page title, falling back to one built from the
+    M3U8 URL, a timestamp and item_index.
+
+    Raises:
+        PlaylistNotFoundError: If the page loaded but no M3U8 link was found on it.
+        ScrapeError: If the page could not be scraped (may succeed on retry).
+    """
+    print(f"Processing scrape task for page: {page_url}")
+    page_title, m3u8_url_found = scrape_page_for_m3u8(page_url)
+    if not m3u8_url_found:
+        raise PlaylistNotFoundError(f"Failed to find M3U8 link for {page_url} after scraping.")
+
+    output_filename = None
+    # Generate filename from title
+    if page_title:
+        sanitized_title = sanitize_filename(page_title)
+        if sanitized_title:
+            output_filename = sanitized_title + ".mp4"
+        else:
+            print(f"  Page title '{page_title}' resulted in invalid filename after sanitization.")
+
+    # Fallback filename for scrape if title missing/invalid
+    if not output_filename:
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        safe_part = m3u8_url_found.split('/')[-1].replace('.m3u8', '').replace('.', '_')
+        output_filename = f"scraped_video_{safe_part}_{timestamp}_{item_index}.mp4"
+        print(f"  Using fallback filename: {output_filename}")
+
+    return m3u8_url_found, output_filename
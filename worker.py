@@ -0,0 +1,172 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import multiprocessing
+from job_queue import JobQueue, DEFAULT_DB_PATH, QUEUED, RUNNING, make_worker_id
+from m3u8_downloader_lib import download_m3u8_video, partial_output_path, DownloaderError
+from page_scraper import resolve_scrape_target, PlaylistNotFoundError
+
+# --- Configuration ---
+DEFAULT_DOWNLOAD_FOLDER = os.path.abspath('downloads')
+POLL_INTERVAL = 2 # Seconds to sleep when the queue is empty
+
+class _Heartbeat:
+    """Background thread that keeps a job's lease alive while it is being processed."""
+
+    def __init__(self, queue, job_id, worker_id):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = max(1, queue.lease_seconds / 3)
+        self.lost = threading.Event() # Set once another worker may own the job
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.worker_id):
+                    print(f"[Worker {self.worker_id}] Lost lease on job {self.job_id}; aborting it.")
+                    self.lost.set()
+                    return
+            except Exception as e:
+                # A transient DB error should not kill the job; the next beat may succeed
+                print(f"[Worker {self.worker_id}] Heartbeat error for job {self.job_id}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+def process_job(job, download_folder, cancel_event=None, queue=None):
+    """
+    Runs a single job payload to completion. Raises on failure or when cancel_event is set.
+
+    If queue is given, the output filename of a scrape job is recorded on the job once known.
+    """
+    payload = job['payload']
+    job_type = payload.get('type')
+
+    if job_type == 'scrape':
+        m3u8_url, output_filename = resolve_scrape_target(payload['page_url'], payload.get('item_index', 0))
+        if queue is not None:
+            queue.set_output_filename(job['id'], job['worker_id'], output_filename)
+    elif job_type == 'direct':
+        m3u8_url, output_filename = payload['m3u8_url'], payload['output_filename']
+    else:
+        raise DownloaderError(f"Unknown job type: {job_type}")
+
+    output_path = os.path.join(download_folder, output_filename)
+    # Progressive jobs also write an ordered TS prefix that app.py can serve while downloading
+    progressive_path = partial_output_path(output_path) if payload.get('progressive') else None
+    print(f"[Job {job['id']}] Downloading {m3u8_url} to {output_path}")
+    include_subtitles = bool(payload.get('subtitles'))
+    if not download_m3u8_video(m3u8_url, output_path, include_subtitles=include_subtitles,
+                               progressive_path=progressive_path, cancel_event=cancel_event):
+        raise DownloaderError(f"Download reported failure for {m3u8_url}")
+    print(f"[Job {job['id']}] Downloaded {m3u8_url}")
+
+def _remove_orphaned_partial(queue, job_id, download_folder):
+    """
+    Deletes an aborted job's in-progress TS file unless another worker may still write it.
+
+    A lost lease usually means the job was re-queued for someone else, but claim() marks
+    it failed instead once its attempts are used up, and then nobody owns the file.
+    """
+    job = queue.get(job_id)
+    output_filename = job['payload'].get('output_filename') if job else None
+    if not output_filename or job['status'] in (QUEUED, RUNNING):
+        return
+    partial_path = partial_output_path(os.path.join(download_folder, output_filename))
+    try:
+        os.remove(partial_path)
+        print(f"[Job {job_id}] Removed {partial_path} (job is {job['status']})")
+    except FileNotFoundError:
+        pass
+
+def run_worker(db_path=DEFAULT_DB_PATH, download_folder=DEFAULT_DOWNLOAD_FOLDER, once=False):
+    """
+    Claims and processes jobs until interrupted.
+
+    Args:
+        db_path (str): Path to the SQLite queue database.
+        download_folder (str): Directory where finished MP4 files are written.
+        once (bool): Exit as soon as the queue is empty instead of polling.
+    """
+    queue = JobQueue(db_path)
+    worker_id = make_worker_id()
+    os.makedirs(download_folder, exist_ok=True)
+    print(f"[Worker {worker_id}] Started (queue: {db_path}, downloads: {download_folder})")
+
+    while True:
+        job = queue.claim(worker_id)
+        if job is None:
+            if once:
+                return
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        print(f"[Worker {worker_id}] Claimed job {job['id']} (attempt {job['attempts']}/{job['max_attempts']})")
+        heartbeat = _Heartbeat(queue, job['id'], worker_id)
+        try:
+            with heartbeat:
+                process_job(job, download_folder, cancel_event=heartbeat.lost, queue=queue)
+            if queue.complete(job['id'], worker_id):
+                print(f"[Worker {worker_id}] Finished job {job['id']}")
+            else:
+                print(f"[Worker {worker_id}] Job {job['id']} was superseded by another worker; result discarded.")
+        except (FileNotFoundError, ImportError) as e:
+            # ffmpeg or Playwright is missing on this host: hand the job back for a correctly set up worker
+            print(f"[Worker {worker_id}] {e} Releasing job {job['id']} and stopping this worker.")
+            queue.release(job['id'], worker_id, e)
+            return
+        except Exception as e:
+            if heartbeat.lost.is_set():
+                print(f"[Worker {worker_id}] Job {job['id']} aborted after losing its lease.")
+                _remove_orphaned_partial(queue, job['id'], download_folder)
+                continue
+            # A page that loaded without an M3U8 link won't grow one on retry;
+            # ScrapeError (timeouts, browser failures) goes through the normal retries
+            retry = not isinstance(e, PlaylistNotFoundError)
+            print(f"[Worker {worker_id}] Job {job['id']} failed: {e}")
+            queue.fail(job['id'], worker_id, e, retry=retry)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run download workers against the shared job queue.")
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes to start on this machine (default: CPU count).")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help="Path to the SQLite job queue.")
+    parser.add_argument('--download-folder', default=DEFAULT_DOWNLOAD_FOLDER,
+                        help="Directory (may be shared between machines) where MP4 files are saved.")
+    parser.add_argument('--once', action='store_true', help="Exit when the queue is empty.")
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(args.db)
+    download_folder = os.path.abspath(args.download_folder)
+
+    if args.processes <= 1:
+        run_worker(db_path, download_folder, args.once)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(db_path, download_folder, args.once))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("\nStopping workers. Unfinished jobs will be re-queued when their leases expire.")
+        for process in processes:
+            process.terminate()
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()